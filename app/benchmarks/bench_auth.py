@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+import auth
+
+def bench_get_password_hash(bench):
+    bench("auth.get_password_hash", auth.get_password_hash, "correct horse battery", rounds=3)
+
+def bench_verify_password(bench):
+    hashed = auth.get_password_hash("correct horse battery")
+    bench("auth.verify_password", auth.verify_password, "correct horse battery", hashed, rounds=3)
+
+def bench_create_access_token(bench):
+    bench(
+        "auth.create_access_token",
+        auth.create_access_token,
+        {"sub": "user1"},
+        timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES),
+        iterations=1000
+    )
+
+def bench_jwt_decode(bench):
+    token = auth.create_access_token({"sub": "user1"})
+    bench(
+        "auth.jwt.decode",
+        auth.jwt.decode,
+        token,
+        auth.SECRET_KEY,
+        algorithms=[auth.ALGORITHM],
+        iterations=1000
+    )
+
+def bench_get_current_user(bench, seeded_db):
+    token = auth.create_access_token({"sub": "user1"})
+    bench("auth.get_current_user", auth.get_current_user, token, seeded_db, iterations=200)
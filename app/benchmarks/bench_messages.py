@@ -0,0 +1,42 @@
+import pytest
+import json
+from datetime import datetime
+
+# Representative payloads for every websocket message type, sized like real traffic
+SDP = "v=0\r\no=- 4611731400430051336 2 IN IP4 127.0.0.1\r\n" + "a=candidate:1 1 udp 2122260223 192.168.1.10 54321 typ host\r\n" * 40
+BROADCASTERS = [f"user{i}" for i in range(1000)]
+CHAT = [{"from": f"user{i}", "text": "hello from the chat " * 3, "sent_at": datetime(2025, 1, 1).isoformat()} for i in range(50)]
+
+MESSAGES = {
+    "start_broadcast": {"type": "start_broadcast", "title": "My stream"},
+    "stop_broadcast": {"type": "stop_broadcast"},
+    "broadcast_started": {"type": "broadcast_started", "broadcaster": "user1", "stream_id": 123456},
+    "broadcast_stopped": {"type": "broadcast_stopped", "broadcaster": "user1"},
+    "broadcasters_list": {"type": "broadcasters_list", "epoch": "1a2b3c4d", "version": 4321, "broadcasters": BROADCASTERS},
+    "broadcasters_delta": {"type": "broadcasters_delta", "epoch": "1a2b3c4d", "version": 4322, "added": ["user1001"], "removed": [], "renamed": []},
+    "get_broadcasters": {"type": "get_broadcasters", "epoch": "1a2b3c4d", "version": 4321},
+    "viewer_joined": {"type": "viewer_joined", "target": "user1"},
+    "viewer_left": {"type": "viewer_left", "target": "user1"},
+    "viewer_count_update": {"type": "viewer_count_update", "count": 1234},
+    "offer": {"type": "offer", "target": "user1", "offer": {"type": "offer", "sdp": SDP}},
+    "answer": {"type": "answer", "target": "user1", "answer": {"type": "answer", "sdp": SDP}},
+    "ice-candidate": {"type": "ice-candidate", "target": "user1", "candidate": {
+        "candidate": "candidate:1 1 udp 2122260223 192.168.1.10 54321 typ host",
+        "sdpMid": "0",
+        "sdpMLineIndex": 0
+    }},
+    "username_changed": {"type": "username_changed", "old_username": "user1", "new_username": "user2"},
+    "join_chat": {"type": "join_chat", "target": "user1"},
+    "chat_message": {"type": "chat_message", "target": "user1", "text": "hello from the chat"},
+    "chat_history": {"type": "chat_history", "stream": "user1", "messages": CHAT},
+    "chat_batch": {"type": "chat_batch", "stream": "user1", "messages": CHAT[:10]},
+    "server_migrate": {"type": "server_migrate", "reconnect_after": 4321},
+}
+
+@pytest.mark.parametrize("message_type", sorted(MESSAGES))
+def bench_encode(bench, message_type):
+    bench(f"encode {message_type}", json.dumps, MESSAGES[message_type], iterations=2000)
+
+@pytest.mark.parametrize("message_type", sorted(MESSAGES))
+def bench_decode(bench, message_type):
+    bench(f"decode {message_type}", json.loads, json.dumps(MESSAGES[message_type]), iterations=2000)
@@ -0,0 +1,34 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import models
+from main import app
+from db import get_db
+
+@pytest.fixture
+def client(seeded_db):
+    def override_get_db():
+        yield seeded_db
+
+    app.dependency_overrides[get_db] = override_get_db
+    # Without the context manager the lifespan (and its production DB) never runs
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+def _get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response
+
+def bench_streams_ended_first_page(bench, client):
+    bench("GET /streams/ended?limit=10", _get, client, "/streams/ended?limit=10", rounds=3)
+
+def bench_streams_ended_large_page(bench, client):
+    bench("GET /streams/ended?limit=100", _get, client, "/streams/ended?limit=100", rounds=3)
+
+def bench_streams_ended_deep_page(bench, client, seeded_db):
+    url = f"/streams/ended?skip={seeded_db.query(models.Stream).count() // 2}&limit=10"
+    bench("GET /streams/ended deep page", _get, client, url, rounds=3)
+
+def bench_streams_active(bench, client):
+    bench("GET /streams/active", _get, client, "/streams/active", rounds=3)
@@ -0,0 +1,168 @@
+import pytest
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, func
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_FILE = os.path.join(BENCH_DIR, "baselines.json")
+DATA_DIR = os.path.join(BENCH_DIR, ".data")
+
+# Seed sizes, overridable for quick local runs
+BENCH_USERS = int(os.environ.get("BENCH_USERS", "10000"))
+BENCH_STREAMS = int(os.environ.get("BENCH_STREAMS", "1000000"))
+BENCH_ACTIVE_STREAMS = int(os.environ.get("BENCH_ACTIVE_STREAMS", "500"))
+SEED_CHUNK = 50000
+
+def pytest_addoption(parser):
+    parser.addoption("--bench-save", action="store_true",
+                     help="write measured timings to baselines.json")
+    parser.addoption("--bench-threshold", type=float, default=0.25,
+                     help="allowed slowdown over the baseline before failing (0.25 = 25%)")
+    parser.addoption("--bench-require-baseline", action="store_true",
+                     help="fail benchmarks that have no recorded baseline instead of only reporting them")
+
+def pytest_configure(config):
+    config.bench_results = {}
+
+# A plain run from app/ also loads this conftest without the options above,
+# so the session hooks look them up with defaults
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    if config.getoption("--bench-save", default=False) and getattr(config, "bench_results", None):
+        baselines = _load_baselines()
+        baselines.update(config.bench_results)
+        with open(BASELINES_FILE, "w") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not getattr(config, "bench_results", None):
+        return
+    baselines = _load_baselines()
+    terminalreporter.section("benchmarks")
+    missing = 0
+    for name, result in sorted(config.bench_results.items()):
+        line = f"{name:<50} {result['per_call_us']:>14.2f} us/call"
+        if name in baselines:
+            change = result["per_call_us"] / baselines[name]["per_call_us"] - 1
+            line += f"  ({change:+.1%} vs baseline)"
+        else:
+            line += "  (no baseline)"
+            missing += 1
+        terminalreporter.write_line(line)
+    # Without a baseline nothing was compared, so say so rather than pass quietly
+    if missing and not config.getoption("--bench-save", default=False):
+        terminalreporter.write_line(
+            f"{missing} benchmarks have no baseline and were not checked for regressions; "
+            f"record one with --bench-save",
+            yellow=True
+        )
+
+def _load_baselines():
+    if not os.path.exists(BASELINES_FILE):
+        return {}
+    with open(BASELINES_FILE) as f:
+        return json.load(f)
+
+@pytest.fixture
+def bench(request):
+    config = request.config
+    baselines = _load_baselines()
+
+    def run(name, func, *args, iterations=1, rounds=5, **kwargs):
+        # Warm caches and lazy imports before timing
+        func(*args, **kwargs)
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func(*args, **kwargs)
+            timings.append((time.perf_counter() - start) / iterations)
+
+        # The fastest round is the least disturbed by the rest of the machine
+        per_call_us = min(timings) * 1e6
+        config.bench_results[name] = {
+            "per_call_us": round(per_call_us, 3),
+            "median_us": round(statistics.median(timings) * 1e6, 3),
+            "rounds": rounds,
+            "iterations": iterations
+        }
+
+        baseline = baselines.get(name)
+        if baseline is None and config.getoption("--bench-require-baseline") \
+                and not config.getoption("--bench-save"):
+            pytest.fail(f"{name} has no baseline in {os.path.basename(BASELINES_FILE)}; record one with --bench-save")
+        if baseline and not config.getoption("--bench-save"):
+            limit = baseline["per_call_us"] * (1 + config.getoption("--bench-threshold"))
+            if per_call_us > limit:
+                pytest.fail(
+                    f"{name} regressed: {per_call_us:.2f} us/call, "
+                    f"baseline {baseline['per_call_us']:.2f} us/call"
+                )
+        return per_call_us
+
+    return run
+
+@pytest.fixture(scope="session")
+def seeded_engine():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"bench_{BENCH_USERS}_{BENCH_STREAMS}_{BENCH_ACTIVE_STREAMS}.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    # Seeding a million rows takes a while, so reuse a complete database
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        seeded = connection.execute(func.count(models.Stream.id).select()).scalar()
+    if seeded != BENCH_STREAMS:
+        models.Base.metadata.drop_all(bind=engine)
+        models.Base.metadata.create_all(bind=engine)
+        _seed(engine)
+    yield engine
+    engine.dispose()
+
+def _seed(engine):
+    rng = random.Random(42)
+    started = datetime(2025, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(models.User), [
+            {"id": i, "username": f"user{i}", "hashed_password": "x"}
+            for i in range(1, BENCH_USERS + 1)
+        ])
+        ended_streams = BENCH_STREAMS - BENCH_ACTIVE_STREAMS
+        for offset in range(0, BENCH_STREAMS, SEED_CHUNK):
+            rows = []
+            for i in range(offset, min(offset + SEED_CHUNK, BENCH_STREAMS)):
+                stream_start = started + timedelta(minutes=i)
+                active = i >= ended_streams
+                rows.append({
+                    "id": i + 1,
+                    "broadcaster_id": rng.randint(1, BENCH_USERS),
+                    "title": f"Stream {i}",
+                    "started_at": stream_start,
+                    "ended_at": None if active else stream_start + timedelta(minutes=rng.randint(1, 240)),
+                    "is_active": active,
+                    "viewer_count": rng.randint(0, 5000)
+                })
+            connection.execute(insert(models.Stream), rows)
+
+@pytest.fixture
+def seeded_db(seeded_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=seeded_engine)()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
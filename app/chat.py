@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+from starlette.concurrency import run_in_threadpool
+
+import models
+import db
+
+# Chat settings
+CHAT_HISTORY_SIZE = 100  # messages kept per room for late joiners
+CHAT_MAX_LENGTH = 500  # characters per message
+CHAT_BATCH_WINDOW = 0.01  # seconds to collect messages before fan-out
+CHAT_FANOUT_CHUNK = 200  # sockets sent to before yielding to the event loop
+CHAT_SEND_TIMEOUT = 1.0  # seconds a viewer may take to accept a frame before being dropped
+CHAT_PERSIST = os.environ.get("CHAT_PERSIST", "0") == "1"
+CHAT_PERSIST_INTERVAL = 2.0  # seconds between write-behind flushes
+CHAT_PERSIST_BATCH = 500  # rows per write-behind flush
+CHAT_PERSIST_QUEUE_SIZE = 50000  # unsaved messages kept; the oldest are dropped beyond this
+CHAT_PERSIST_RETRIES = 3  # failed writes of a batch before it is dropped
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRoom:
+    def __init__(self, name: str):
+        self.name = name
+        self.history: Deque[dict] = deque(maxlen=CHAT_HISTORY_SIZE)
+        self.members: Set[WebSocket] = set()
+        self.pending: List[dict] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+
+class ChatManager:
+    def __init__(self):
+        self.rooms: Dict[str, ChatRoom] = {}
+        self.memberships: Dict[WebSocket, Set[str]] = {}
+        self.persist_queue: Deque[models.ChatMessage] = deque(maxlen=CHAT_PERSIST_QUEUE_SIZE)
+        self.persist_retry: List[models.ChatMessage] = []  # batch whose write failed, tried first
+        self.persist_task: Optional[asyncio.Task] = None
+        self.persist_failures = 0
+        self.persist_dropped = 0
+
+    def join(self, websocket: WebSocket, room_name: str) -> List[dict]:
+        room = self.rooms.get(room_name)
+        if room is None:
+            room = self.rooms[room_name] = ChatRoom(room_name)
+        room.members.add(websocket)
+        self.memberships.setdefault(websocket, set()).add(room_name)
+        return list(room.history)
+
+    def leave(self, websocket: WebSocket, room_name: str):
+        room = self.rooms.get(room_name)
+        if room is not None:
+            room.members.discard(websocket)
+        rooms = self.memberships.get(websocket)
+        if rooms is not None:
+            rooms.discard(room_name)
+            if not rooms:
+                del self.memberships[websocket]
+
+    def leave_all(self, websocket: WebSocket):
+        for room_name in list(self.memberships.get(websocket, ())):
+            self.leave(websocket, room_name)
+
+    def close_room(self, room_name: str):
+        room = self.rooms.pop(room_name, None)
+        if room is None:
+            return
+        for websocket in list(room.members):
+            self.leave(websocket, room_name)
+
+    def rename_room(self, old_name: str, new_name: str):
+        room = self.rooms.pop(old_name, None)
+        if room is None:
+            return
+        room.name = new_name
+        self.rooms[new_name] = room
+        for websocket in room.members:
+            rooms = self.memberships[websocket]
+            rooms.discard(old_name)
+            rooms.add(new_name)
+
+    def post(self, websocket: WebSocket, room_name: str, sender: str, text: str,
+             stream_id: Optional[int] = None) -> Optional[dict]:
+        room = self.rooms.get(room_name)
+        text = text.strip()[:CHAT_MAX_LENGTH]
+        if room is None or websocket not in room.members or not text:
+            return None
+
+        sent_at = datetime.utcnow()
+        entry = {"from": sender, "text": text, "sent_at": sent_at.isoformat()}
+        room.history.append(entry)
+        room.pending.append(entry)
+        if room.flush_task is None:
+            room.flush_task = asyncio.create_task(self._flush_room(room))
+
+        if CHAT_PERSIST and stream_id is not None:
+            if len(self.persist_queue) == self.persist_queue.maxlen:
+                self.persist_dropped += 1
+            self.persist_queue.append(models.ChatMessage(
+                stream_id=stream_id,
+                username=sender,
+                text=text,
+                sent_at=sent_at
+            ))
+            if self.persist_task is None:
+                self.persist_task = asyncio.create_task(self._persist_loop())
+        return entry
+
+    async def _flush_room(self, room: ChatRoom):
+        # One fan-out per room at a time; messages posted while it runs
+        # are picked up by the next pass instead of starting another task
+        try:
+            while True:
+                # Let messages arriving within the window share a single frame
+                await asyncio.sleep(CHAT_BATCH_WINDOW)
+                batch, room.pending = room.pending, []
+                if not batch:
+                    return
+                await self._fan_out(room, json.dumps({
+                    "type": "chat_batch",
+                    "stream": room.name,
+                    "messages": batch
+                }))
+        finally:
+            room.flush_task = None
+
+    async def _fan_out(self, room: ChatRoom, frame: str):
+        members = list(room.members)
+        for i in range(0, len(members), CHAT_FANOUT_CHUNK):
+            chunk = members[i:i + CHAT_FANOUT_CHUNK]
+            results = await asyncio.gather(
+                *(asyncio.wait_for(websocket.send_text(frame), CHAT_SEND_TIMEOUT) for websocket in chunk),
+                return_exceptions=True
+            )
+            # Viewers that error or can't keep up stop receiving chat
+            for websocket, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    self.leave(websocket, room.name)
+
+    async def _persist_loop(self):
+        try:
+            while self.persist_queue or self.persist_retry:
+                await asyncio.sleep(CHAT_PERSIST_INTERVAL)
+                await self.flush_persisted()
+        finally:
+            self.persist_task = None
+
+    async def flush(self):
+        # Deliver batches still waiting out their window, then write everything queued
+        tasks = [room.flush_task for room in self.rooms.values() if room.flush_task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush_persisted()
+
+    async def flush_persisted(self):
+        if self.persist_dropped:
+            logger.warning("Chat persistence queue full, dropped %d messages", self.persist_dropped)
+            self.persist_dropped = 0
+        while self.persist_retry or self.persist_queue:
+            rows = self.persist_retry or [
+                self.persist_queue.popleft()
+                for _ in range(min(CHAT_PERSIST_BATCH, len(self.persist_queue)))
+            ]
+            self.persist_retry = []
+            try:
+                await run_in_threadpool(_write_rows, rows)
+            except Exception:
+                self.persist_failures += 1
+                if self.persist_failures >= CHAT_PERSIST_RETRIES:
+                    logger.exception("Dropping %d chat messages after %d failed writes",
+                                     len(rows), self.persist_failures)
+                    self.persist_failures = 0
+                else:
+                    # Held outside the bounded queue so messages posted meanwhile
+                    # can't push it out, or be pushed out by it
+                    logger.exception("Failed to write %d chat messages, will retry", len(rows))
+                    self.persist_retry = rows
+                return
+            self.persist_failures = 0
+
+
+def _write_rows(rows: List[models.ChatMessage]):
+    session = db.SessionLocal()
+    try:
+        session.add_all(rows)
+        session.commit()
+    finally:
+        session.close()
+
+
+chat_manager = ChatManager()
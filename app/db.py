@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -16,4 +16,15 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
+
+def warm_pool():
+    # Open the pool's connections up front so the first requests don't pay for them
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    connections = [engine.connect() for _ in range(size)]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
\ No newline at end of file
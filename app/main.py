@@ -1,19 +1,128 @@
 from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Form
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from datetime import timedelta, datetime
+import asyncio
 import json
-from typing import Dict, List
+import logging
+import random
+from typing import Dict, List, Optional
 
 import models
 import db
 import auth
 from db import engine
+import chat
+from chat import chat_manager
+from registry import BroadcasterRegistry
+import tracing
 
-models.Base.metadata.create_all(bind=engine)
+# Deploy settings
+STREAM_HEARTBEAT_INTERVAL = 15  # seconds between heartbeats for the streams this process serves
+STREAM_STALE_AFTER = 60  # seconds without a heartbeat before another process ends a stream
+DRAIN_RECONNECT_SPREAD = 10  # seconds over which migrating clients spread their reconnects
+DRAIN_SEND_TIMEOUT = 1.0  # seconds a client may take to accept the migrate notice or close frame
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+server_state = {"ready": False, "draining": False}
+
+tracing.instrument_engine(engine)
+
+def load_active_streams() -> Dict[str, int]:
+    session = db.SessionLocal()
+    try:
+        rows = session.query(models.Stream.id, models.User.username)\
+            .join(models.User, models.Stream.broadcaster_id == models.User.id)\
+            .filter(models.Stream.is_active == True)\
+            .all()
+        return {username: stream_id for stream_id, username in rows}
+    finally:
+        session.close()
+
+def stream_id(stream: models.Stream) -> int:
+    # Read the primary key from the identity map; touching stream.id after its
+    # session committed would reload the whole row with a blocking SELECT
+    return inspect(stream).identity[0]
+
+def end_streams(stream_ids: List[int]):
+    session = db.SessionLocal()
+    try:
+        session.query(models.Stream)\
+            .filter(models.Stream.id.in_(stream_ids), models.Stream.is_active == True)\
+            .update({"is_active": False, "ended_at": datetime.utcnow()}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+def touch_streams(stream_ids: List[int]):
+    session = db.SessionLocal()
+    try:
+        session.query(models.Stream)\
+            .filter(models.Stream.id.in_(stream_ids))\
+            .update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+def end_stale_streams() -> List[int]:
+    # Streams without any heartbeat predate it and have no owner to check, so they are left alone
+    cutoff = datetime.utcnow() - timedelta(seconds=STREAM_STALE_AFTER)
+    session = db.SessionLocal()
+    try:
+        stale = [
+            row.id for row in session.query(models.Stream.id)
+            .filter(models.Stream.is_active == True, models.Stream.heartbeat_at < cutoff)
+            .all()
+        ]
+        if stale:
+            session.query(models.Stream)\
+                .filter(models.Stream.id.in_(stale), models.Stream.heartbeat_at < cutoff)\
+                .update({"is_active": False, "ended_at": datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+        return stale
+    finally:
+        session.close()
+
+async def maintain_streams():
+    # Heartbeat our own streams so overlapping instances leave them alone, and
+    # end streams whose process stopped heartbeating without draining
+    while True:
+        await asyncio.sleep(STREAM_HEARTBEAT_INTERVAL)
+        try:
+            owned = [stream_id(stream) for stream in active_streams.values()]
+            if owned:
+                await run_in_threadpool(touch_streams, owned)
+            ended = set(await run_in_threadpool(end_stale_streams))
+        except Exception:
+            logger.exception("Stream heartbeat failed")
+            continue
+        for username, resumable_id in list(resumable_streams.items()):
+            if resumable_id in ended:
+                del resumable_streams[username]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    server_state["draining"] = False
+    await run_in_threadpool(models.Base.metadata.create_all, bind=engine)
+    await run_in_threadpool(db.warm_pool)
+    # Streams still marked active belong to another process, live or crashed;
+    # their broadcasters may reconnect here and pick them up again
+    resumable_streams.update(await run_in_threadpool(load_active_streams))
+    maintain_task = asyncio.create_task(maintain_streams())
+    server_state["ready"] = True
+    try:
+        yield
+    finally:
+        maintain_task.cancel()
+        await drain()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -23,36 +132,139 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(tracing.TracingMiddleware)
 
 # Store active connections and broadcasters
 active_connections: Dict[str, WebSocket] = {}
-broadcasters: Dict[str, str] = {}  # username -> connection_id
+connection_usernames: Dict[WebSocket, str] = {}  # follows username changes for open sockets
+broadcasters = BroadcasterRegistry()  # versioned, changes go out as broadcasters_delta
 active_streams: Dict[str, models.Stream] = {}  # username -> Stream object
+resumable_streams: Dict[str, int] = {}  # username -> stream id left active by another process
 
 class ConnectionManager:
     async def connect(self, websocket: WebSocket, username: str):
         await websocket.accept()
         active_connections[username] = websocket
+        connection_usernames[websocket] = username
 
-    def disconnect(self, username: str):
+    def disconnect(self, username: str) -> Optional[dict]:
         if username in active_connections:
-            del active_connections[username]
-        if username in broadcasters:
-            del broadcasters[username]
-        if username in active_streams:
-            stream = active_streams[username]
-            stream.ended_at = datetime.utcnow()
-            stream.is_active = False
-            db.SessionLocal().commit()
-            del active_streams[username]
+            connection_usernames.pop(active_connections.pop(username), None)
+        return broadcasters.remove(username)
+
+    async def end_stream(self, username: str):
+        stream = active_streams.pop(username, None)
+        if stream is not None:
+            chat_manager.close_room(username)
+            await run_in_threadpool(end_streams, [stream_id(stream)])
+
+    async def broadcast_json(self, payload: dict, exclude: str = None):
+        # Encoded once for every recipient, like send_json
+        with tracing.span("encode"):
+            message = json.dumps(payload)
+        await self.broadcast(message, exclude)
 
     async def broadcast(self, message: str, exclude: str = None):
-        for username, connection in active_connections.items():
-            if username != exclude:
-                await connection.send_text(message)
+        with tracing.span("send"):
+            for username, connection in active_connections.items():
+                if username != exclude:
+                    await connection.send_text(message)
 
 manager = ConnectionManager()
 
+async def send_json(websocket: WebSocket, payload: dict):
+    with tracing.span("encode"):
+        text = json.dumps(payload)
+    with tracing.span("send"):
+        await websocket.send_text(text)
+
+async def drain() -> int:
+    if server_state["draining"]:
+        return 0
+    server_state["ready"] = False
+    server_state["draining"] = True
+
+    # Deliver pending chat and write it out before anything is torn down;
+    # a failure here must not stop the streams from being ended
+    try:
+        await chat_manager.flush()
+    except Exception:
+        logger.exception("Failed to flush chat while draining")
+
+    # Ask every client to reconnect elsewhere, spreading the reconnects out
+    # so the whole audience doesn't arrive at the next instance at once.
+    # A client that stopped reading is given up on rather than holding up the drain
+    connections = list(active_connections.values())
+    await asyncio.gather(*(
+        asyncio.wait_for(connection.send_text(json.dumps({
+            "type": "server_migrate",
+            "reconnect_after": int(random.uniform(0, DRAIN_RECONNECT_SPREAD) * 1000)
+        })), DRAIN_SEND_TIMEOUT)
+        for connection in connections
+    ), return_exceptions=True)
+
+    # End every stream with one UPDATE instead of one commit per disconnect.
+    # Resumable streams are left to whichever process still heartbeats them
+    stream_ids = [stream_id(stream) for stream in active_streams.values()]
+    for username in list(active_streams):
+        chat_manager.close_room(username)
+    active_streams.clear()
+    broadcasters.clear()
+    resumable_streams.clear()
+    if stream_ids:
+        await run_in_threadpool(end_streams, stream_ids)
+
+    # 1012: service restart
+    await asyncio.gather(*(
+        asyncio.wait_for(connection.close(code=1012), DRAIN_SEND_TIMEOUT)
+        for connection in connections
+    ), return_exceptions=True)
+    return len(stream_ids)
+
+@app.get("/health/ready")
+async def readiness():
+    if not server_state["ready"]:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "draining" if server_state["draining"] else "starting"}
+        )
+    return {"status": "ready"}
+
+@app.post("/admin/drain", dependencies=[Depends(auth.require_admin)])
+async def admin_drain():
+    closed_streams = await drain()
+    return {"message": "Server drained", "closed_streams": closed_streams}
+
+@app.get("/admin/traces", dependencies=[Depends(auth.require_admin)])
+async def admin_traces(min_ms: float = 0, limit: int = 50):
+    return {
+        "sample_rate": tracing.TRACE_SAMPLE_RATE,
+        "traces": tracing.slow_traces(min_ms, limit)
+    }
+
+@app.post("/admin/traces/sample-rate", dependencies=[Depends(auth.require_admin)])
+async def admin_trace_sample_rate(rate: float = Form(...)):
+    tracing.set_sample_rate(rate)
+    return {"sample_rate": tracing.TRACE_SAMPLE_RATE}
+
+@app.post("/admin/profiler/start", dependencies=[Depends(auth.require_admin)])
+async def admin_profiler_start(seconds: float = Form(10)):
+    if not tracing.profiler.start(seconds):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler already running",
+        )
+    return {"message": "Profiler started", "seconds": min(seconds, tracing.PROFILER_MAX_SECONDS)}
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(auth.require_admin)])
+async def admin_profiler_stop():
+    await run_in_threadpool(tracing.profiler.stop)
+    return tracing.profiler.results()
+
+@app.get("/admin/profiler", dependencies=[Depends(auth.require_admin)])
+async def admin_profiler(limit: int = 50):
+    return tracing.profiler.results(limit)
+
 @app.post("/register")
 async def register(username: str = Form(...), password: str = Form(...), db: Session = Depends(db.get_db)):
     db_user = db.query(models.User).filter(models.User.username == username).first()
@@ -84,6 +296,10 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 @app.websocket("/ws/{token}")
 async def websocket_endpoint(websocket: WebSocket, token: str, db: Session = Depends(db.get_db)):
+    if server_state["draining"]:
+        await websocket.close(code=1012)
+        return
+
     try:
         payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         username = payload.get("sub")
@@ -98,133 +314,165 @@ async def websocket_endpoint(websocket: WebSocket, token: str, db: Session = Dep
     try:
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            if message["type"] == "start_broadcast":
-                # Create new stream record
-                user = db.query(models.User).filter(models.User.username == username).first()
-                stream = models.Stream(
-                    broadcaster_id=user.id,
-                    title=message.get("title", "Untitled Stream"),
-                    is_active=True
-                )
-                db.add(stream)
-                db.commit()
-                db.refresh(stream)
+            username = connection_usernames.get(websocket, username)
+            with tracing.trace("ws") as trace:
+                with tracing.span("decode"):
+                    message = json.loads(data)
+                if trace:
+                    trace.name = f"ws:{message['type']}"
                 
-                broadcasters[username] = username
-                active_streams[username] = stream
+                if message["type"] == "start_broadcast":
+                    # Resume the stream this broadcaster had before a restart, if any
+                    stream = None
+                    if username in resumable_streams:
+                        stream = db.get(models.Stream, resumable_streams.pop(username))
+                    if stream is not None and stream.is_active:
+                        stream.title = message.get("title", stream.title)
+                        stream.viewer_count = 0
+                        stream.heartbeat_at = datetime.utcnow()
+                        db.commit()
+                    else:
+                        # Create new stream record
+                        user = db.query(models.User).filter(models.User.username == username).first()
+                        stream = models.Stream(
+                            broadcaster_id=user.id,
+                            title=message.get("title", "Untitled Stream"),
+                            is_active=True,
+                            heartbeat_at=datetime.utcnow()
+                        )
+                        db.add(stream)
+                        db.commit()
+                        db.refresh(stream)
                 
-                # Broadcast to all clients including the sender
-                await manager.broadcast(json.dumps({
-                    "type": "broadcast_started",
-                    "broadcaster": username,
-                    "stream_id": stream.id
-                }), None)  # Remove exclude parameter to include sender
+                    delta = broadcasters.add(username)
+                    active_streams[username] = stream
                 
-                # Also send broadcasters list to all clients
-                await manager.broadcast(json.dumps({
-                    "type": "broadcasters_list",
-                    "broadcasters": list(broadcasters.keys())
-                }))
-            
-            elif message["type"] == "stop_broadcast":
-                if username in broadcasters:
-                    del broadcasters[username]
-                if username in active_streams:
-                    stream = active_streams[username]
-                    stream.ended_at = datetime.utcnow()
-                    stream.is_active = False
-                    db.commit()
-                    del active_streams[username]
+                    # Broadcast to all clients including the sender
+                    await manager.broadcast_json({
+                        "type": "broadcast_started",
+                        "broadcaster": username,
+                        "stream_id": stream.id
+                    }, None)  # Remove exclude parameter to include sender
                 
-                # Broadcast to all clients including the sender
-                await manager.broadcast(json.dumps({
-                    "type": "broadcast_stopped",
-                    "broadcaster": username
-                }), None)  # Remove exclude parameter to include sender
+                    # Only the change goes out; clients patch their own list
+                    if delta:
+                        await manager.broadcast_json(delta)
                 
-                # Also send updated broadcasters list to all clients
-                await manager.broadcast(json.dumps({
-                    "type": "broadcasters_list",
-                    "broadcasters": list(broadcasters.keys())
-                }))
-            
-            elif message["type"] == "viewer_joined":
-                if message["target"] in active_streams:
-                    stream = active_streams[message["target"]]
-                    stream.viewer_count += 1
-                    db.commit()
-                    # Notify the broadcaster about the viewer count update
+                elif message["type"] == "stop_broadcast":
+                    delta = broadcasters.remove(username)
+                    if username in active_streams:
+                        stream = active_streams[username]
+                        stream.ended_at = datetime.utcnow()
+                        stream.is_active = False
+                        db.commit()
+                        del active_streams[username]
+                        chat_manager.close_room(username)
+                
+                    # Broadcast to all clients including the sender
+                    await manager.broadcast_json({
+                        "type": "broadcast_stopped",
+                        "broadcaster": username
+                    }, None)  # Remove exclude parameter to include sender
+                
+                    if delta:
+                        await manager.broadcast_json(delta)
+                
+                elif message["type"] == "viewer_joined":
+                    if message["target"] in active_streams:
+                        stream = active_streams[message["target"]]
+                        stream.viewer_count += 1
+                        db.commit()
+                        # Notify the broadcaster about the viewer count update
+                        if message["target"] in active_connections:
+                            await send_json(active_connections[message["target"]], {
+                                "type": "viewer_count_update",
+                                "count": stream.viewer_count
+                            })
+                
+                elif message["type"] == "viewer_left":
+                    if message["target"] in active_streams:
+                        stream = active_streams[message["target"]]
+                        stream.viewer_count = max(0, stream.viewer_count - 1)
+                        db.commit()
+                        # Notify the broadcaster about the viewer count update
+                        if message["target"] in active_connections:
+                            await send_json(active_connections[message["target"]], {
+                                "type": "viewer_count_update",
+                                "count": stream.viewer_count
+                            })
+                
+                elif message["type"] == "offer":
                     if message["target"] in active_connections:
-                        await active_connections[message["target"]].send_text(json.dumps({
-                            "type": "viewer_count_update",
-                            "count": stream.viewer_count
-                        }))
-            
-            elif message["type"] == "viewer_left":
-                if message["target"] in active_streams:
-                    stream = active_streams[message["target"]]
-                    stream.viewer_count = max(0, stream.viewer_count - 1)
-                    db.commit()
-                    # Notify the broadcaster about the viewer count update
+                        await send_json(active_connections[message["target"]], {
+                            "type": "offer",
+                            "offer": message["offer"],
+                            "from": username
+                        })
+                
+                elif message["type"] == "answer":
                     if message["target"] in active_connections:
-                        await active_connections[message["target"]].send_text(json.dumps({
-                            "type": "viewer_count_update",
-                            "count": stream.viewer_count
-                        }))
-            
-            elif message["type"] == "offer":
-                if message["target"] in active_connections:
-                    await active_connections[message["target"]].send_text(json.dumps({
-                        "type": "offer",
-                        "offer": message["offer"],
-                        "from": username
-                    }))
-            
-            elif message["type"] == "answer":
-                if message["target"] in active_connections:
-                    await active_connections[message["target"]].send_text(json.dumps({
-                        "type": "answer",
-                        "answer": message["answer"],
-                        "from": username
-                    }))
-            
-            elif message["type"] == "ice-candidate":
-                if message["target"] in active_connections:
-                    await active_connections[message["target"]].send_text(json.dumps({
-                        "type": "ice-candidate",
-                        "candidate": message["candidate"],
-                        "from": username
-                    }))
-            
-            elif message["type"] == "get_broadcasters":
-                await websocket.send_text(json.dumps({
-                    "type": "broadcasters_list",
-                    "broadcasters": list(broadcasters.keys())
-                }))
+                        await send_json(active_connections[message["target"]], {
+                            "type": "answer",
+                            "answer": message["answer"],
+                            "from": username
+                        })
+                
+                elif message["type"] == "ice-candidate":
+                    if message["target"] in active_connections:
+                        await send_json(active_connections[message["target"]], {
+                            "type": "ice-candidate",
+                            "candidate": message["candidate"],
+                            "from": username
+                        })
+                
+                elif message["type"] == "get_broadcasters":
+                    # Clients that send their last epoch and version only get what they missed
+                    deltas = broadcasters.deltas_since(message.get("epoch"), message.get("version"))
+                    if deltas is None:
+                        await send_json(websocket, broadcasters.snapshot())
+                    else:
+                        for delta in deltas:
+                            await send_json(websocket, delta)
+                
+                elif message["type"] == "join_chat":
+                    if message["target"] in active_streams:
+                        history = chat_manager.join(websocket, message["target"])
+                        # Send recent messages so late joiners see the conversation
+                        await send_json(websocket, {
+                            "type": "chat_history",
+                            "stream": message["target"],
+                            "messages": history
+                        })
+                
+                elif message["type"] == "leave_chat":
+                    chat_manager.leave(websocket, message["target"])
+                
+                elif message["type"] == "chat_message":
+                    stream = active_streams.get(message["target"])
+                    # The stream belongs to the broadcaster's session, so its id
+                    # comes from the identity map and only when it will be saved
+                    # Delivered to the room in batches as "chat_batch" frames
+                    chat_manager.post(
+                        websocket,
+                        message["target"],
+                        username,
+                        str(message.get("text", "")),
+                        stream_id(stream) if stream is not None and chat.CHAT_PERSIST else None
+                    )
 
     except WebSocketDisconnect:
-        manager.disconnect(username)
-        if username in broadcasters:
-            del broadcasters[username]
-            if username in active_streams:
-                stream = active_streams[username]
-                stream.ended_at = datetime.utcnow()
-                stream.is_active = False
-                db.commit()
-                del active_streams[username]
+        username = connection_usernames.get(websocket, username)
+        chat_manager.leave_all(websocket)
+        delta = manager.disconnect(username)
+        await manager.end_stream(username)
+        if delta:
             # Broadcast to all clients including the sender
-            await manager.broadcast(json.dumps({
+            await manager.broadcast_json({
                 "type": "broadcast_stopped",
                 "broadcaster": username
-            }), None)  # Remove exclude parameter to include sender
+            }, None)  # Remove exclude parameter to include sender
             
-            # Also send updated broadcasters list to all clients
-            await manager.broadcast(json.dumps({
-                "type": "broadcasters_list",
-                "broadcasters": list(broadcasters.keys())
-            }))
+            await manager.broadcast_json(delta)
 
 @app.post("/users/change-password")
 async def change_password(
@@ -285,18 +533,25 @@ async def change_username(
     if old_username in active_connections:
         active_connections[new_username] = active_connections[old_username]
         del active_connections[old_username]
+        connection_usernames[active_connections[new_username]] = new_username
+    
+    # The stream and its chat room are keyed by the broadcaster's name too
+    if old_username in active_streams:
+        active_streams[new_username] = active_streams.pop(old_username)
+        chat_manager.rename_room(old_username, new_username)
+    if old_username in resumable_streams:
+        resumable_streams[new_username] = resumable_streams.pop(old_username)
     
     # If user is currently broadcasting, update the broadcaster list
-    if old_username in broadcasters:
-        broadcasters[new_username] = broadcasters[old_username]
-        del broadcasters[old_username]
-        
+    delta = broadcasters.rename(old_username, new_username)
+    if delta:
         # Notify all clients of the name change
-        await manager.broadcast(json.dumps({
+        await manager.broadcast_json({
             "type": "username_changed",
             "old_username": old_username,
             "new_username": new_username
-        }))
+        })
+        await manager.broadcast_json(delta)
     
     return {
         "access_token": access_token,
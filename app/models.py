@@ -24,5 +24,15 @@ class Stream(Base):
     ended_at = Column(DateTime(timezone=True), nullable=True)
     is_active = Column(Boolean, default=True)
     viewer_count = Column(Integer, default=0)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
     
-    broadcaster = relationship("User", back_populates="streams") 
\ No newline at end of file
+    broadcaster = relationship("User", back_populates="streams") 
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    stream_id = Column(Integer, ForeignKey("streams.id"), index=True)
+    username = Column(String(100))
+    text = Column(String(500))
+    sent_at = Column(DateTime(timezone=True), server_default=func.now())
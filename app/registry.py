@@ -0,0 +1,83 @@
+import secrets
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional
+
+# Registry settings
+BROADCASTER_LOG_SIZE = 1000  # deltas kept for clients catching up
+
+
+class BroadcasterRegistry:
+    def __init__(self):
+        # A fresh epoch per process so versions from a previous run are never trusted
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.names: Dict[str, str] = {}  # username -> connection_id
+        self.log: Deque[dict] = deque(maxlen=BROADCASTER_LOG_SIZE)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, username: str) -> Optional[dict]:
+        if username in self.names:
+            return None
+        self.names[username] = username
+        return self._record(added=[username])
+
+    def remove(self, username: str) -> Optional[dict]:
+        if username not in self.names:
+            return None
+        del self.names[username]
+        return self._record(removed=[username])
+
+    def rename(self, old_username: str, new_username: str) -> Optional[dict]:
+        if old_username not in self.names:
+            return None
+        self.names[new_username] = self.names.pop(old_username)
+        return self._record(renamed=[{"old_username": old_username, "new_username": new_username}])
+
+    def clear(self) -> Optional[dict]:
+        if not self.names:
+            return None
+        removed = list(self.names)
+        self.names.clear()
+        return self._record(removed=removed)
+
+    def snapshot(self) -> dict:
+        return {
+            "type": "broadcasters_list",
+            "epoch": self.epoch,
+            "version": self.version,
+            "broadcasters": list(self.names)
+        }
+
+    def deltas_since(self, epoch: Optional[str], version: Optional[int]) -> Optional[List[dict]]:
+        # None means the client has to start over from a snapshot
+        if epoch != self.epoch or not isinstance(version, int) or version > self.version:
+            return None
+        if version == self.version:
+            return []
+        oldest = self.log[0]["version"] if self.log else self.version + 1
+        if version + 1 < oldest:
+            return None
+        deltas = list(islice(self.log, version + 1 - oldest, None))
+        # Past a point replaying costs more than resending the list
+        if len(deltas) > len(self.names):
+            return None
+        return deltas
+
+    def _record(self, added=(), removed=(), renamed=()) -> dict:
+        self.version += 1
+        delta = {
+            "type": "broadcasters_delta",
+            "epoch": self.epoch,
+            "version": self.version,
+            "added": list(added),
+            "removed": list(removed),
+            "renamed": list(renamed)
+        }
+        self.log.append(delta)
+        return delta
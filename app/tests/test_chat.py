@@ -0,0 +1,168 @@
+import pytest
+from fastapi import WebSocket
+import asyncio
+import json
+from unittest.mock import AsyncMock
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat
+from chat import ChatManager
+
+@pytest.mark.asyncio
+async def test_chat_messages_are_batched():
+    chat_manager = ChatManager()
+    viewers = [AsyncMock(spec=WebSocket) for _ in range(3)]
+    for viewer in viewers:
+        chat_manager.join(viewer, "streamer")
+
+    for i in range(5):
+        chat_manager.post(viewers[0], "streamer", "viewer0", f"message {i}")
+    await chat_manager.flush()
+
+    # All five messages reach each viewer in a single frame
+    for viewer in viewers:
+        viewer.send_text.assert_awaited_once()
+        frame = json.loads(viewer.send_text.await_args.args[0])
+        assert frame["type"] == "chat_batch"
+        assert [m["text"] for m in frame["messages"]] == [f"message {i}" for i in range(5)]
+
+@pytest.mark.asyncio
+async def test_chat_history_is_bounded():
+    chat_manager = ChatManager()
+    viewer = AsyncMock(spec=WebSocket)
+    chat_manager.join(viewer, "streamer")
+
+    for i in range(chat.CHAT_HISTORY_SIZE + 10):
+        chat_manager.post(viewer, "streamer", "viewer", f"message {i}")
+
+    history = chat_manager.join(AsyncMock(spec=WebSocket), "streamer")
+    assert len(history) == chat.CHAT_HISTORY_SIZE
+    assert history[-1]["text"] == f"message {chat.CHAT_HISTORY_SIZE + 9}"
+    await chat_manager.flush()
+
+@pytest.mark.asyncio
+async def test_chat_requires_membership():
+    chat_manager = ChatManager()
+    chat_manager.join(AsyncMock(spec=WebSocket), "streamer")
+    outsider = AsyncMock(spec=WebSocket)
+    assert chat_manager.post(outsider, "streamer", "outsider", "hello") is None
+
+@pytest.mark.asyncio
+async def test_chat_drops_failed_sockets():
+    chat_manager = ChatManager()
+    viewer = AsyncMock(spec=WebSocket)
+    broken = AsyncMock(spec=WebSocket)
+    broken.send_text.side_effect = RuntimeError("closed")
+    chat_manager.join(viewer, "streamer")
+    chat_manager.join(broken, "streamer")
+
+    chat_manager.post(viewer, "streamer", "viewer", "hello")
+    await chat_manager.flush()
+
+    assert broken not in chat_manager.rooms["streamer"].members
+    assert broken not in chat_manager.memberships
+
+@pytest.mark.asyncio
+async def test_chat_close_room():
+    chat_manager = ChatManager()
+    viewer = AsyncMock(spec=WebSocket)
+    chat_manager.join(viewer, "streamer")
+    chat_manager.close_room("streamer")
+    assert "streamer" not in chat_manager.rooms
+    assert viewer not in chat_manager.memberships
+
+@pytest.mark.asyncio
+async def test_chat_slow_viewer_does_not_stall_room(monkeypatch):
+    monkeypatch.setattr(chat, "CHAT_FANOUT_CHUNK", 2)
+    monkeypatch.setattr(chat, "CHAT_SEND_TIMEOUT", 0.05)
+    chat_manager = ChatManager()
+
+    async def hang(frame):
+        await asyncio.sleep(3600)
+
+    stuck = AsyncMock(spec=WebSocket)
+    stuck.send_text.side_effect = hang
+    viewers = [AsyncMock(spec=WebSocket) for _ in range(3)]
+    chat_manager.join(stuck, "streamer")
+    for viewer in viewers:
+        chat_manager.join(viewer, "streamer")
+
+    for i in range(5):
+        chat_manager.post(viewers[0], "streamer", "viewer0", f"message {i}")
+        await asyncio.sleep(chat.CHAT_BATCH_WINDOW * 2)
+    await chat_manager.flush()
+
+    # The stuck socket is dropped and everyone else gets every message
+    assert stuck not in chat_manager.rooms["streamer"].members
+    for viewer in viewers:
+        received = [
+            m["text"]
+            for call in viewer.send_text.await_args_list
+            for m in json.loads(call.args[0])["messages"]
+        ]
+        assert received == [f"message {i}" for i in range(5)]
+    assert chat_manager.rooms["streamer"].flush_task is None
+
+@pytest.mark.asyncio
+async def test_chat_persist_retries_failed_writes(monkeypatch):
+    written = []
+    failures = [RuntimeError("database unavailable")] * 2
+
+    def write_rows(rows):
+        if failures:
+            raise failures.pop()
+        written.extend(rows)
+
+    monkeypatch.setattr(chat, "_write_rows", write_rows)
+    chat_manager = ChatManager()
+    chat_manager.persist_queue.extend(["first", "second"])
+
+    await chat_manager.flush_persisted()
+    await chat_manager.flush_persisted()
+    assert written == []
+    assert chat_manager.persist_retry == ["first", "second"]
+
+    await chat_manager.flush_persisted()
+    assert written == ["first", "second"]
+    assert not chat_manager.persist_queue and not chat_manager.persist_retry
+
+@pytest.mark.asyncio
+async def test_chat_persist_drops_batch_after_retries(monkeypatch):
+    def write_rows(rows):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(chat, "_write_rows", write_rows)
+    chat_manager = ChatManager()
+    chat_manager.persist_queue.extend(["first", "second"])
+
+    for _ in range(chat.CHAT_PERSIST_RETRIES):
+        await chat_manager.flush_persisted()
+    assert not chat_manager.persist_queue and not chat_manager.persist_retry
+
+@pytest.mark.asyncio
+async def test_chat_persist_retry_survives_full_queue(monkeypatch):
+    monkeypatch.setattr(chat, "CHAT_PERSIST_QUEUE_SIZE", 4)
+    chat_manager = ChatManager()
+    written = []
+
+    def write_rows(rows):
+        if not written:
+            written.append(None)
+            # The queue fills up while the failing write is in flight
+            chat_manager.persist_queue.extend(["third", "fourth", "fifth", "sixth"])
+            raise RuntimeError("database unavailable")
+        written.extend(rows)
+
+    monkeypatch.setattr(chat, "_write_rows", write_rows)
+    chat_manager.persist_queue.extend(["first", "second"])
+
+    await chat_manager.flush_persisted()
+    await chat_manager.flush_persisted()
+    assert written[1:] == ["first", "second", "third", "fourth", "fifth", "sixth"]
+
+def test_chat_persist_queue_is_bounded():
+    assert ChatManager().persist_queue.maxlen == chat.CHAT_PERSIST_QUEUE_SIZE
@@ -2,7 +2,10 @@ import pytest
 from fastapi.testclient import TestClient
 from fastapi import WebSocket
 import json
+import asyncio
 import random
+import time
+from datetime import datetime, timedelta
 import string
 from unittest.mock import AsyncMock, patch
 import sys
@@ -11,9 +14,16 @@ import os
 # Add parent directory to path to import app modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from main import app, manager, active_connections
+from main import app, manager, active_connections, active_streams, broadcasters, resumable_streams
+import main
+import chat
+from chat import chat_manager
+import auth
+import tracing
+import models
 from models import Base
 from db import engine, get_db
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import sessionmaker
 
 # Create test database
@@ -143,4 +153,269 @@ def test_login_fuzz(client):
         username = generate_random_string()
         password = generate_random_string()
         response = client.post("/token", data={"username": username, "password": password})
-        assert response.status_code in [200, 401]  # Either success or unauthorized 
\ No newline at end of file
+        assert response.status_code in [200, 401]  # Either success or unauthorized 
+
+def test_readiness(client):
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+def test_drain_requires_admin(client):
+    response = client.post("/admin/drain")
+    assert response.status_code == 403
+
+def test_drain_ends_streams(client, test_db, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "admin-secret")
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+        # As after any later commit in the broadcaster's session
+        stream = active_streams["testuser"]
+        inspect(stream).session.expire(stream)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = client.post("/admin/drain", headers={"X-Admin-Token": "admin-secret"})
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert response.status_code == 200
+        # One batched UPDATE, no per-stream reloads
+        assert len(statements) == 1 and statements[0].startswith("UPDATE streams")
+        assert response.json()["closed_streams"] == 1
+        assert websocket.receive_json()["type"] == "server_migrate"
+
+    assert client.get("/health/ready").status_code == 503
+    assert not active_streams
+    test_db.expire_all()
+    assert test_db.query(models.Stream).filter(models.Stream.is_active == True).count() == 0
+
+def test_admin_traces(client, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "admin-secret")
+    headers = {"X-Admin-Token": "admin-secret"}
+    response = client.post("/admin/traces/sample-rate", data={"rate": "1"}, headers=headers)
+    assert response.json() == {"sample_rate": 1.0}
+
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    client.post("/admin/traces/sample-rate", data={"rate": "0"}, headers=headers)
+
+    traces = client.get("/admin/traces", headers=headers).json()["traces"]
+    register = [t for t in traces if t["name"] == "http:POST /register"]
+    assert register
+    assert "auth" in register[0]["spans"]
+    assert "db" in register[0]["spans"]
+
+def test_broadcast_encoding_is_traced(client, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+
+    # The trace is recorded once the handler returns, after the sends
+    for _ in range(50):
+        ws = [t for t in tracing.traces if t["name"] == "ws:start_broadcast"]
+        if ws:
+            break
+        time.sleep(0.01)
+    # broadcast_started and the delta are each encoded once for every socket
+    assert ws[-1]["spans"]["encode"]["count"] == 2
+
+def test_broadcasters_delta(client):
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "get_broadcasters"}))
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "broadcasters_list"
+
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        delta = websocket.receive_json()
+        assert delta["type"] == "broadcasters_delta"
+        assert delta["version"] == snapshot["version"] + 1
+        assert delta["added"] == ["testuser"]
+
+        # Catching up from the snapshot only returns the missed delta
+        websocket.send_text(json.dumps({
+            "type": "get_broadcasters",
+            "epoch": snapshot["epoch"],
+            "version": snapshot["version"]
+        }))
+        assert websocket.receive_json() == delta
+
+        websocket.send_text(json.dumps({"type": "stop_broadcast"}))
+        assert websocket.receive_json()["type"] == "broadcast_stopped"
+        assert websocket.receive_json()["removed"] == ["testuser"]
+    assert "testuser" not in broadcasters
+
+def test_drain_survives_chat_flush_error(client, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "admin-secret")
+    async def broken_flush():
+        raise RuntimeError("database unavailable")
+    monkeypatch.setattr(chat_manager, "flush", broken_flush)
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+
+        response = client.post("/admin/drain", headers={"X-Admin-Token": "admin-secret"})
+        assert response.json()["closed_streams"] == 1
+        assert websocket.receive_json()["type"] == "server_migrate"
+
+def test_drain_does_not_wait_for_stuck_clients(client, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "admin-secret")
+    monkeypatch.setattr(main, "DRAIN_SEND_TIMEOUT", 0.05)
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    # A client that stopped reading: its sends and close never complete
+    stuck = AsyncMock(spec=WebSocket)
+    stuck.send_text.side_effect = hang
+    stuck.close.side_effect = hang
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+        monkeypatch.setitem(active_connections, "stuck", stuck)
+
+        response = client.post("/admin/drain", headers={"X-Admin-Token": "admin-secret"})
+        assert response.json()["closed_streams"] == 1
+        assert websocket.receive_json()["type"] == "server_migrate"
+    assert not active_streams
+
+def test_rename_while_broadcasting(client):
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        assert websocket.receive_json()["type"] == "broadcast_started"
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+        websocket.send_text(json.dumps({"type": "join_chat", "target": "testuser"}))
+        assert websocket.receive_json()["type"] == "chat_history"
+
+        response = client.post(
+            "/users/change-username",
+            data={"new_username": "renamed", "password": "testpass"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert websocket.receive_json()["type"] == "username_changed"
+        assert websocket.receive_json()["renamed"] == [{"old_username": "testuser", "new_username": "renamed"}]
+
+        # The stream and its chat room are now found under the new name
+        websocket.send_text(json.dumps({"type": "join_chat", "target": "renamed"}))
+        assert websocket.receive_json()["type"] == "chat_history"
+        assert "renamed" in active_streams
+
+    # Disconnecting under the old socket still ends the renamed stream; the
+    # server handles the disconnect after the test client has moved on
+    for _ in range(50):
+        if "renamed" not in active_streams:
+            break
+        time.sleep(0.01)
+    assert "renamed" not in active_streams
+    assert "renamed" not in chat_manager.rooms
+    assert "testuser" not in chat_manager.rooms
+
+def test_resume_stream_after_restart(test_db):
+    user = models.User(username="testuser", hashed_password=auth.get_password_hash("testpass"))
+    test_db.add(user)
+    test_db.commit()
+    stream = models.Stream(broadcaster_id=user.id, title="Before restart", is_active=True, heartbeat_at=datetime.utcnow())
+    test_db.add(stream)
+    test_db.commit()
+
+    def override_get_db():
+        yield test_db
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with TestClient(app) as client:
+            # Startup picks up the stream left active by the previous process
+            assert resumable_streams == {"testuser": stream.id}
+            token = auth.create_access_token({"sub": "testuser"})
+            with client.websocket_connect(f"/ws/{token}") as websocket:
+                websocket.send_text(json.dumps({"type": "start_broadcast", "title": "After restart"}))
+                started = websocket.receive_json()
+                assert started["type"] == "broadcast_started"
+                assert started["stream_id"] == stream.id
+            assert "testuser" not in resumable_streams
+    finally:
+        app.dependency_overrides.clear()
+
+def test_end_stale_streams(test_db):
+    user = models.User(username="testuser", hashed_password="x")
+    test_db.add(user)
+    test_db.commit()
+    now = datetime.utcnow()
+    stale = models.Stream(broadcaster_id=user.id, is_active=True,
+                          heartbeat_at=now - timedelta(seconds=main.STREAM_STALE_AFTER + 30))
+    live = models.Stream(broadcaster_id=user.id, is_active=True, heartbeat_at=now)
+    legacy = models.Stream(broadcaster_id=user.id, is_active=True)
+    test_db.add_all([stale, live, legacy])
+    test_db.commit()
+
+    # Only the stream whose owner stopped heartbeating is ended
+    assert main.end_stale_streams() == [stale.id]
+    test_db.expire_all()
+    assert not stale.is_active and stale.ended_at is not None
+    assert live.is_active
+    assert legacy.is_active
+
+    main.touch_streams([legacy.id])
+    test_db.expire_all()
+    assert legacy.heartbeat_at is not None
+
+def test_chat_message_does_not_reload_stream(client, monkeypatch):
+    written = []
+    monkeypatch.setattr(chat, "CHAT_PERSIST", True)
+    monkeypatch.setattr(chat, "CHAT_PERSIST_INTERVAL", 0.01)
+    monkeypatch.setattr(chat, "_write_rows", written.extend)
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    token = client.post("/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws/{token}") as websocket:
+        websocket.send_text(json.dumps({"type": "start_broadcast", "title": "Test"}))
+        stream_id = websocket.receive_json()["stream_id"]
+        assert websocket.receive_json()["type"] == "broadcasters_delta"
+        websocket.send_text(json.dumps({"type": "join_chat", "target": "testuser"}))
+        assert websocket.receive_json()["type"] == "chat_history"
+        # As after a viewer_joined commit in the broadcaster's session
+        stream = active_streams["testuser"]
+        inspect(stream).session.expire(stream)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            websocket.send_text(json.dumps({"type": "chat_message", "target": "testuser", "text": "hello"}))
+            assert websocket.receive_json()["type"] == "chat_batch"
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert statements == []
+
+        for _ in range(50):
+            if written:
+                break
+            time.sleep(0.01)
+        assert [row.stream_id for row in written] == [stream_id]
\ No newline at end of file
@@ -0,0 +1,68 @@
+import pytest
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registry
+from registry import BroadcasterRegistry
+
+def test_registry_records_deltas():
+    broadcasters = BroadcasterRegistry()
+    added = broadcasters.add("alice")
+    assert added["type"] == "broadcasters_delta"
+    assert added["version"] == 1
+    assert added["added"] == ["alice"]
+
+    renamed = broadcasters.rename("alice", "alice2")
+    assert renamed["renamed"] == [{"old_username": "alice", "new_username": "alice2"}]
+    assert "alice2" in broadcasters
+
+    removed = broadcasters.remove("alice2")
+    assert removed["removed"] == ["alice2"]
+    assert broadcasters.version == 3
+
+def test_registry_ignores_no_ops():
+    broadcasters = BroadcasterRegistry()
+    broadcasters.add("alice")
+    assert broadcasters.add("alice") is None
+    assert broadcasters.remove("bob") is None
+    assert broadcasters.rename("bob", "carol") is None
+    assert broadcasters.version == 1
+
+def test_registry_deltas_since():
+    broadcasters = BroadcasterRegistry()
+    for name in ("alice", "bob", "carol"):
+        broadcasters.add(name)
+
+    assert broadcasters.deltas_since(broadcasters.epoch, 3) == []
+    assert [d["version"] for d in broadcasters.deltas_since(broadcasters.epoch, 1)] == [2, 3]
+
+def test_registry_requires_snapshot():
+    broadcasters = BroadcasterRegistry()
+    for name in ("alice", "bob"):
+        broadcasters.add(name)
+
+    # Unknown epoch, missing version or a version from the future
+    assert broadcasters.deltas_since("other", 1) is None
+    assert broadcasters.deltas_since(broadcasters.epoch, None) is None
+    assert broadcasters.deltas_since(broadcasters.epoch, 5) is None
+    # Replaying would cost more than the list itself
+    broadcasters.remove("alice")
+    broadcasters.remove("bob")
+    assert broadcasters.deltas_since(broadcasters.epoch, 0) is None
+
+def test_registry_log_is_bounded(monkeypatch):
+    monkeypatch.setattr(registry, "BROADCASTER_LOG_SIZE", 5)
+    broadcasters = BroadcasterRegistry()
+    for i in range(20):
+        broadcasters.add(f"user{i}")
+
+    assert len(broadcasters.log) == 5
+    assert broadcasters.deltas_since(broadcasters.epoch, 10) is None
+    assert len(broadcasters.deltas_since(broadcasters.epoch, 16)) == 4
+
+    snapshot = broadcasters.snapshot()
+    assert snapshot["version"] == 20
+    assert len(snapshot["broadcasters"]) == 20
@@ -0,0 +1,61 @@
+import pytest
+import time
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracing
+
+@pytest.fixture
+def sampled(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    tracing.traces.clear()
+    yield
+    tracing.traces.clear()
+
+def test_tracing_off_records_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    tracing.traces.clear()
+    with tracing.trace("ws:offer") as trace:
+        with tracing.span("decode"):
+            pass
+    assert trace is None
+    assert len(tracing.traces) == 0
+
+def test_trace_records_spans(sampled):
+    with tracing.trace("ws:offer"):
+        with tracing.span("decode"):
+            pass
+        with tracing.span("send"):
+            pass
+        with tracing.span("send"):
+            pass
+
+    recorded = tracing.traces[-1]
+    assert recorded["name"] == "ws:offer"
+    assert recorded["error"] is None
+    assert recorded["spans"]["decode"]["count"] == 1
+    assert recorded["spans"]["send"]["count"] == 2
+
+def test_slow_traces_sorted(sampled):
+    for delay in (0, 0.02, 0.01):
+        with tracing.trace("http:GET /streams/active"):
+            time.sleep(delay)
+
+    slow = tracing.slow_traces(min_ms=5)
+    assert len(slow) == 2
+    assert slow[0]["duration_ms"] >= slow[1]["duration_ms"]
+
+def test_profiler_collects_samples():
+    profiler = tracing.Profiler()
+    assert profiler.start(5, interval=0.001)
+    assert not profiler.start(5)
+    time.sleep(0.05)
+    profiler.stop()
+
+    results = profiler.results()
+    assert not results["running"]
+    assert results["samples"] > 0
+    assert results["stacks"]
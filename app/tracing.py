@@ -0,0 +1,202 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import event
+
+# Tracing settings
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))  # fraction of messages/requests traced
+TRACE_BUFFER_SIZE = 1000  # finished traces kept in memory
+PROFILER_INTERVAL = 0.005  # seconds between stack samples
+PROFILER_MAX_SECONDS = 300
+
+traces: Deque[dict] = deque(maxlen=TRACE_BUFFER_SIZE)
+_current: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class _Noop:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.spans: Dict[str, List[float]] = {}  # span name -> [count, total ms]
+        self._start = 0.0
+        self._token = None
+
+    def add_span(self, name: str, elapsed_ms: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [1, elapsed_ms]
+        else:
+            span[0] += 1
+            span[1] += elapsed_ms
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        _current.reset(self._token)
+        traces.append({
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(duration_ms, 3),
+            "error": exc_type.__name__ if exc_type else None,
+            "spans": {
+                name: {"count": int(count), "ms": round(total, 3)}
+                for name, (count, total) in self.spans.items()
+            }
+        })
+        return False
+
+
+class _Span:
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_span(self.name, (time.perf_counter() - self._start) * 1000)
+        return False
+
+
+def trace(name: str):
+    # Unsampled work gets a shared no-op so tracing off costs one comparison
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return _NOOP
+    return Trace(name)
+
+
+def span(name: str):
+    current = _current.get()
+    if current is None:
+        return _NOOP
+    return _Span(current, name)
+
+
+def set_sample_rate(rate: float):
+    global TRACE_SAMPLE_RATE
+    TRACE_SAMPLE_RATE = min(max(rate, 0.0), 1.0)
+
+
+def slow_traces(min_ms: float = 0, limit: int = 50) -> List[dict]:
+    slow = [t for t in traces if t["duration_ms"] >= min_ms]
+    slow.sort(key=lambda t: t["duration_ms"], reverse=True)
+    return slow[:limit]
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("trace_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        current = _current.get()
+        starts = conn.info.get("trace_start")
+        if current is not None and starts:
+            current.add_span("db", (time.perf_counter() - starts.pop()) * 1000)
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with trace(f"http:{scope['method']} {scope['path']}"):
+            return await self.app(scope, receive, send)
+
+
+class Profiler:
+    def __init__(self):
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = PROFILER_INTERVAL) -> bool:
+        if self.running:
+            return False
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(min(seconds, PROFILER_MAX_SECONDS), interval),
+            name="profiler",
+            daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, seconds: float, interval: float):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+        self.stopped_at = time.time()
+
+    def results(self, limit: int = 50) -> dict:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": self.sample_count,
+            # Collapsed stacks, root first, ready for flamegraph tools
+            "stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in self.samples.most_common(limit)
+            ]
+        }
+
+
+profiler = Profiler()
@@ -54,7 +54,7 @@ function TabPanel(props: TabPanelProps) {
 }
 
 export const Streaming: React.FC<StreamingProps> = ({ username, onLogout, onProfileClick }) => {
-    const [broadcasters, setBroadcasters] = useState<string[]>([]);
+    const [broadcasters, setBroadcasters] = useState<string[]>(websocketService.getBroadcasters());
     const [isBroadcasting, setIsBroadcasting] = useState(false);
     const [showStartDialog, setShowStartDialog] = useState(false);
     const [streamTitle, setStreamTitle] = useState('');
@@ -67,7 +67,7 @@ export const Streaming: React.FC<StreamingProps> = ({ username, onLogout, onProf
     const endedStreamsPage = useRef(0);
 
     const requestBroadcastersList = () => {
-        websocketService.send({ type: 'get_broadcasters' });
+        websocketService.requestBroadcastersList();
     };
 
     // Load initial data
@@ -120,18 +120,11 @@ export const Streaming: React.FC<StreamingProps> = ({ username, onLogout, onProf
         const handleMessage = (message: WebSocketMessage) => {
             switch (message.type) {
                 case 'broadcasters_list':
-                    setBroadcasters(message.broadcasters || []);
-                    break;
-                case 'broadcast_started':
-                    setBroadcasters(prev => {
-                        if (!prev.includes(message.broadcaster!)) {
-                            return [...prev, message.broadcaster!];
-                        }
-                        return prev;
-                    });
+                case 'broadcasters_delta':
+                    // The websocket service keeps the list in sync with the server's version
+                    setBroadcasters(websocketService.getBroadcasters());
                     break;
                 case 'broadcast_stopped':
-                    setBroadcasters(prev => prev.filter(b => b !== message.broadcaster));
                     if (videoRefs.current[message.broadcaster!]) {
                         delete videoRefs.current[message.broadcaster!];
                     }
@@ -153,9 +146,6 @@ export const Streaming: React.FC<StreamingProps> = ({ username, onLogout, onProf
                     break;
                 case 'username_changed':
                     if (message.old_username && message.new_username) {
-                        setBroadcasters(prev => 
-                            prev.map(b => b === message.old_username ? message.new_username! : b)
-                        );
                         if (videoRefs.current[message.old_username]) {
                             const video = videoRefs.current[message.old_username];
                             videoRefs.current[message.new_username!] = video;
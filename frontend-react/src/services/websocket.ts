@@ -5,6 +5,11 @@ class WebSocketService {
     private ws: WebSocket | null = null;
     private token: string | null = null;
     private messageHandlers: ((message: WebSocketMessage) => void)[] = [];
+    private reconnectDelay = 1000;
+    private broadcasters: string[] = [];
+    private broadcastersEpoch: string | null = null;
+    private broadcastersVersion = 0;
+    private broadcastersCatchingUp = false;
 
     constructor() {
         this.token = localStorage.getItem('token');
@@ -31,18 +36,31 @@ class WebSocketService {
 
         this.ws.onmessage = (event) => {
             const message = JSON.parse(event.data) as WebSocketMessage;
+
+            if (message.type === 'broadcasters_list' || message.type === 'broadcasters_delta') {
+                if (!this.applyBroadcasters(message)) {
+                    return;
+                }
+            }
             
             // Handle username changes in the webrtc service
             if (message.type === 'username_changed' && message.old_username && message.new_username) {
                 webrtcService.handleUsernameChange(message.old_username, message.new_username);
             }
+
+            // Server is shutting down; reconnect after the delay it picked for us
+            if (message.type === 'server_migrate' && message.reconnect_after !== undefined) {
+                this.reconnectDelay = message.reconnect_after;
+            }
             
             this.messageHandlers.forEach(handler => handler(message));
         };
 
         this.ws.onclose = () => {
             console.log('WebSocket disconnected, reconnecting...');
-            setTimeout(() => this.connect(), 1000);
+            const delay = this.reconnectDelay;
+            this.reconnectDelay = 1000;
+            setTimeout(() => this.connect(), delay);
         };
 
         this.ws.onerror = (error) => {
@@ -84,7 +102,48 @@ class WebSocketService {
     }
 
     requestBroadcastersList() {
-        this.send({ type: 'get_broadcasters' });
+        // With a known version the server only sends the deltas we missed
+        this.send({
+            type: 'get_broadcasters',
+            epoch: this.broadcastersEpoch ?? undefined,
+            version: this.broadcastersVersion
+        });
+    }
+
+    getBroadcasters() {
+        return this.broadcasters;
+    }
+
+    private applyBroadcasters(message: WebSocketMessage): boolean {
+        if (message.type === 'broadcasters_list') {
+            this.broadcasters = message.broadcasters || [];
+            this.broadcastersEpoch = message.epoch ?? null;
+            this.broadcastersVersion = message.version ?? 0;
+            this.broadcastersCatchingUp = false;
+            return true;
+        }
+
+        if (message.epoch === this.broadcastersEpoch && message.version! <= this.broadcastersVersion) {
+            return false;  // Already applied
+        }
+        if (message.epoch !== this.broadcastersEpoch || message.version !== this.broadcastersVersion + 1) {
+            // Missed a change; ask for what's missing once and drop deltas until it arrives
+            if (!this.broadcastersCatchingUp) {
+                this.broadcastersCatchingUp = true;
+                this.requestBroadcastersList();
+            }
+            return false;
+        }
+
+        const removed = new Set(message.removed || []);
+        const renamed = new Map((message.renamed || []).map(r => [r.old_username, r.new_username]));
+        this.broadcasters = this.broadcasters
+            .filter(b => !removed.has(b))
+            .map(b => renamed.get(b) ?? b)
+            .concat((message.added || []).filter(b => !this.broadcasters.includes(b)));
+        this.broadcastersVersion = message.version!;
+        this.broadcastersCatchingUp = false;
+        return true;
     }
 }
 
@@ -5,7 +5,7 @@ export interface User {
 }
 
 export interface WebSocketMessage {
-    type: 'broadcasters_list' | 'broadcast_started' | 'broadcast_stopped' | 'offer' | 'answer' | 'ice-candidate' | 'start_broadcast' | 'stop_broadcast' | 'get_broadcasters' | 'username_changed' | 'viewer_joined' | 'viewer_left' | 'viewer_count_update';
+    type: 'broadcasters_list' | 'broadcast_started' | 'broadcast_stopped' | 'offer' | 'answer' | 'ice-candidate' | 'start_broadcast' | 'stop_broadcast' | 'get_broadcasters' | 'username_changed' | 'viewer_joined' | 'viewer_left' | 'viewer_count_update' | 'join_chat' | 'leave_chat' | 'chat_message' | 'chat_history' | 'chat_batch' | 'server_migrate' | 'broadcasters_delta';
     broadcasters?: string[];
     broadcaster?: string;
     target?: string;
@@ -18,6 +18,21 @@ export interface WebSocketMessage {
     title?: string;
     stream_id?: number;
     count?: number;
+    stream?: string;
+    text?: string;
+    messages?: ChatMessage[];
+    reconnect_after?: number;
+    epoch?: string;
+    version?: number;
+    added?: string[];
+    removed?: string[];
+    renamed?: { old_username: string; new_username: string }[];
+}
+
+export interface ChatMessage {
+    from: string;
+    text: string;
+    sent_at: string;
 }
 
 export interface PeerConnection {